@@ -5,10 +5,10 @@ A Python package for performing Optical Character Recognition (OCR) on images,
 PDF documents, and PowerPoint presentations using OpenAI's Vision API.
 """
 
-from .ocr import MiniOCR
+from .ocr import MiniOCR, PptxFallback
 
 __version__ = "0.0.4"
 __author__ = "Enrike Nur"
 __email__ = "enrike.nur@gmail.com"
 
-__all__ = ["MiniOCR"] 
\ No newline at end of file
+__all__ = ["MiniOCR", "PptxFallback"] 
\ No newline at end of file
@@ -1,21 +1,88 @@
 import asyncio
 import base64
+import functools
 import os
 import platform
+import shutil
+import socket
 import subprocess
-from typing import List, Optional
-from openai import AsyncOpenAI
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from openai import AsyncOpenAI, BadRequestError, DefaultAsyncHttpxClient
 import aiofiles
 import aiohttp
-from pdf2image import convert_from_path, convert_from_bytes
+import httpx
+from pdf2image import convert_from_path, pdfinfo_from_path
 import tempfile
 from pptx import Presentation
 from PIL import Image
 import io
+import mimetypes
+import re
+from .ratelimit import RateLimiter
+
+# pdftoppm/pdftocairo rasterization is CPU-bound and scales with cores
+RENDER_THREAD_COUNT = min(os.cpu_count() or 1, 8)
+# Workers reading and base64-encoding page images ahead of the API requests
+ENCODE_WORKER_COUNT = os.cpu_count() or 1
+# Pages rendered per pdf2image call when streaming pages to the Vision API; at least one
+# page per render thread so every pdftocairo thread has work
+RENDER_CHUNK_SIZE = max(RENDER_THREAD_COUNT, 4)
+# Supported file extensions and the pipeline that handles each
+FILE_KINDS = {
+    '.png': 'image',
+    '.jpg': 'image',
+    '.jpeg': 'image',
+    '.gif': 'image',
+    '.bmp': 'image',
+    '.tiff': 'image',
+    '.webp': 'image',
+    '.pdf': 'pdf',
+    '.pptx': 'pptx',
+}
+# Longest image side worth sending; Vision models tile larger images without gaining detail
+MAX_IMAGE_DIMENSION = 1568
+# Per-page output budget, and the most completion tokens requested for one batch; models
+# with a lower limit (gpt-4-turbo allows 4096) reject batches and get one page per request
+MAX_TOKENS_PER_PAGE = 4000
+MAX_COMPLETION_TOKENS = 16384
+# Rough prompt cost of one page image, used to budget tokens-per-minute limits
+IMAGE_TOKEN_ESTIMATE = 1100
+# Delimiter the model is asked to emit before each page of a batched request
+PAGE_DELIMITER_PATTERN = re.compile(r"^---PAGE (\d+)---[ \t]*$", re.MULTILINE)
+# Long-lived LibreOffice server (from the optional unoserver package) used for PPTX conversion
+UNOSERVER_HOST = "127.0.0.1"
+# LibreOffice leaks memory across conversions, so the server is restarted after this many jobs
+UNOSERVER_MAX_JOBS = 20
+UNOSERVER_STARTUP_TIMEOUT = 30
+
+class PptxFallback(Exception):
+    """Raised when a presentation cannot be rendered to images and its text should be used instead."""
 
 class MiniOCR:
-    def __init__(self, api_key: str = None):
-        self.client = AsyncOpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+    def __init__(self, api_key: str = None, max_connections: int = 10, max_retries: int = 6):
+        self.max_connections = max_connections
+        # Keep connections to the OpenAI API alive across page requests. The client retries
+        # rate limits, timeouts and 5xx errors with jittered exponential backoff, honoring Retry-After.
+        self.client = AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            max_retries=max_retries,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections
+                )
+            )
+        )
+        self._rate_limiters: Dict[Tuple[Optional[int], Optional[int]], RateLimiter] = {}
+        # Models that rejected a batch's max_tokens; their pages are sent one per request
+        self._unbatched_models: Set[str] = set()
+        self._unoserver_proc: Optional[subprocess.Popen] = None
+        self._unoserver_port: Optional[int] = None
+        self._unoserver_jobs = 0
+        self._unoserver_active = 0
+        self._unoserver_lock: Optional[asyncio.Lock] = None
+        self._unoserver_lock_loop: Optional[asyncio.AbstractEventLoop] = None
         self.system_prompt = """
 Convert the following document to markdown.
 Return only the markdown with no explanation text. Do not include delimiters like ```markdown or ```html.
@@ -30,27 +97,117 @@ RULES:
   - Prefer using ☐ and ☑ for check boxes.
 """
 
+    async def __aenter__(self) -> "MiniOCR":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the OpenAI client and LibreOffice server."""
+        await self.stop_unoserver()
+        await self.client.close()
+
+    def __del__(self):
+        # No event loop to wait on here; just make sure the server does not outlive us
+        proc = getattr(self, "_unoserver_proc", None)
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+
+    def get_rate_limiter(self, rpm: Optional[int], tpm: Optional[int]) -> Optional[RateLimiter]:
+        """Get the limiter for these quotas, shared by every ocr() call on this instance."""
+        if not (rpm or tpm):
+            return None
+        if (rpm, tpm) not in self._rate_limiters:
+            self._rate_limiters[(rpm, tpm)] = RateLimiter(rpm, tpm)
+        return self._rate_limiters[(rpm, tpm)]
+
     async def encode_image_to_base64(self, image_path: str) -> str:
         """Encode an image to base64 asynchronously."""
-        async with aiofiles.open(image_path, "rb") as image_file:
-            image_data = await image_file.read()
-        return base64.b64encode(image_data).decode("utf-8")
+        def read_and_encode() -> str:
+            with open(image_path, "rb") as image_file:
+                return base64.b64encode(image_file.read()).decode("utf-8")
+        
+        # Both the read and the CPU-bound base64 encode run off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, read_and_encode)
+
+    def has_alpha(self, image: Image.Image) -> bool:
+        """Check if an image has transparency."""
+        return image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+    def encode_pil_to_base64(self, image: Image.Image, image_format: str = "JPEG") -> str:
+        """Encode an in-memory PIL image to base64 without touching disk."""
+        buffer = io.BytesIO()
+        if image_format.upper() == "JPEG":
+            if self.has_alpha(image):
+                # JPEG has no alpha; put transparent areas on white so dark text stays readable
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(buffer, format="JPEG", quality=85)
+        else:
+            # compress_level=1 encodes ~2x faster than Pillow's default of 6
+            image.save(buffer, format="PNG", compress_level=1, optimize=False)
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+    def encode_downscaled_image(self, image: Image.Image, image_format: str = "JPEG") -> str:
+        """Shrink an image to fit MAX_IMAGE_DIMENSION and encode it to base64."""
+        if image.mode in ("1", "P"):
+            # Pillow only resizes palette and bilevel images with nearest-neighbour sampling
+            image = image.convert("RGBA" if self.has_alpha(image) else "RGB")
+        image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.LANCZOS)
+        return self.encode_pil_to_base64(image, image_format)
+
+    def encode_image_file(self, image_path: str, image_format: str = "JPEG") -> Tuple[str, str]:
+        """Read an image file and get its base64 data and MIME type, downscaling it first if oversized."""
+        with open(image_path, "rb") as image_file:
+            data = image_file.read()
+        
+        # The file is read once; Pillow measures and, if needed, decodes the bytes already in memory
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) > MAX_IMAGE_DIMENSION:
+                mime_type = "image/jpeg" if image_format.upper() == "JPEG" else "image/png"
+                return self.encode_downscaled_image(image, image_format), mime_type
+        
+        return base64.b64encode(data).decode("utf-8"), mimetypes.guess_type(image_path)[0] or "image/png"
+
+    async def prepare_image(self, image_path: str, image_format: str = "JPEG") -> Tuple[str, str]:
+        """
+        Get an image file's base64 data and MIME type, downscaling it first if oversized.
+        
+        Downscaled images are re-encoded as image_format ("JPEG" or "PNG").
+        """
+        # Reading, measuring and encoding all run in one worker thread, off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.encode_image_file, image_path, image_format)
+
+    def get_file_kind(self, file_path: str) -> Optional[str]:
+        """Classify a file as 'image', 'pdf' or 'pptx' by extension, or None if unsupported."""
+        return FILE_KINDS.get(os.path.splitext(file_path)[1].lower())
 
     def is_image_file(self, file_path: str) -> bool:
         """Check if file is an image."""
-        image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp')
-        return file_path.lower().endswith(image_extensions)
+        return self.get_file_kind(file_path) == 'image'
 
     def is_pdf_file(self, file_path: str) -> bool:
         """Check if file is a PDF."""
-        return file_path.lower().endswith('.pdf')
+        return self.get_file_kind(file_path) == 'pdf'
 
     def is_pptx_file(self, file_path: str) -> bool:
         """Check if file is a PowerPoint presentation."""
-        return file_path.lower().endswith('.pptx')
+        return self.get_file_kind(file_path) == 'pptx'
     
-    def find_libreoffice_executable(self) -> Optional[str]:
-        """Find LibreOffice executable path based on the operating system."""
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def find_libreoffice_executable() -> Optional[str]:
+        """Find LibreOffice executable path based on the operating system.
+
+        The lookup is cached for the lifetime of the process.
+        """
         system = platform.system().lower()
         
         # Common executable names to try
@@ -74,15 +231,8 @@ RULES:
         
         # First, try to find in PATH
         for exec_name in executable_names:
-            try:
-                result = subprocess.run(
-                    ["which", exec_name] if system != "windows" else ["where", exec_name],
-                    capture_output=True, text=True, timeout=5
-                )
-                if result.returncode == 0 and result.stdout.strip():
-                    return exec_name  # Found in PATH
-            except (subprocess.TimeoutExpired, FileNotFoundError):
-                continue
+            if shutil.which(exec_name):
+                return exec_name  # Found in PATH
         
         # If not in PATH, try common installation paths
         for path in common_paths:
@@ -92,33 +242,279 @@ RULES:
         # Last resort: try just the executable name and hope it works
         return executable_names[0]
 
+    def find_free_port(self) -> int:
+        """Ask the OS for a currently unused local TCP port."""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind((UNOSERVER_HOST, 0))
+            return sock.getsockname()[1]
+
+    def get_unoserver_lock(self) -> asyncio.Lock:
+        """Get the lock guarding the LibreOffice server state for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._unoserver_lock is None or self._unoserver_lock_loop is not loop:
+            self._unoserver_lock = asyncio.Lock()
+            self._unoserver_lock_loop = loop
+        return self._unoserver_lock
+
+    async def stop_unoserver(self) -> None:
+        """Terminate the LibreOffice server if this instance started one."""
+        proc = self._unoserver_proc
+        self._unoserver_proc = None
+        self._unoserver_port = None
+        self._unoserver_jobs = 0
+        if proc is None or proc.poll() is not None:
+            return
+        
+        proc.terminate()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, functools.partial(proc.wait, timeout=10))
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    async def start_unoserver(self) -> bool:
+        """Start a LibreOffice server with unoserver and wait until it accepts connections."""
+        # Ports are picked per instance so servers from other processes are never mistaken for ours
+        port = self.find_free_port()
+        uno_port = self.find_free_port()
+        self._unoserver_proc = subprocess.Popen(
+            [
+                "unoserver",
+                "--interface", UNOSERVER_HOST,
+                "--port", str(port),
+                "--uno-interface", UNOSERVER_HOST,
+                "--uno-port", str(uno_port)
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        self._unoserver_port = port
+        self._unoserver_jobs = 0
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + UNOSERVER_STARTUP_TIMEOUT
+        while loop.time() < deadline and self._unoserver_proc.poll() is None:
+            try:
+                _, writer = await asyncio.open_connection(UNOSERVER_HOST, port)
+            except OSError:
+                await asyncio.sleep(0.25)
+                continue
+            writer.close()
+            return True
+        
+        print("Warning: unoserver did not start, using one-shot LibreOffice conversion")
+        await self.stop_unoserver()
+        return False
+
+    async def convert_with_unoserver(self, pptx_path: str, pdf_path: str) -> bool:
+        """
+        Convert a presentation to PDF through a long-lived LibreOffice server.
+        
+        Avoids LibreOffice's multi-second startup on every conversion. Returns False when
+        unoserver is not installed or the conversion fails, so callers can fall back to
+        running soffice directly.
+        """
+        if not (shutil.which("unoserver") and shutil.which("unoconvert")):
+            return False
+        
+        lock = self.get_unoserver_lock()
+        async with lock:
+            if self._unoserver_proc is None or self._unoserver_proc.poll() is not None:
+                if not await self.start_unoserver():
+                    return False
+            self._unoserver_jobs += 1
+            self._unoserver_active += 1
+            port = self._unoserver_port
+        
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "unoconvert",
+                "--host", UNOSERVER_HOST,
+                "--port", str(port),
+                "--convert-to", "pdf",
+                pptx_path,
+                pdf_path,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, stderr = await asyncio.wait_for(proc.communicate(), timeout=60)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                print("Warning: unoserver conversion timed out, using one-shot LibreOffice conversion")
+                # The server may be wedged; restart it once no other conversion is using it
+                self._unoserver_jobs = UNOSERVER_MAX_JOBS
+                return False
+        finally:
+            async with lock:
+                self._unoserver_active -= 1
+                # Recycle only when idle so in-flight conversions are never cut off
+                if self._unoserver_active == 0 and self._unoserver_jobs >= UNOSERVER_MAX_JOBS:
+                    await self.stop_unoserver()
+        
+        if proc.returncode != 0 or not os.path.exists(pdf_path):
+            print(f"Warning: unoserver conversion failed (exit code {proc.returncode}): {stderr.decode(errors='replace')}")
+            return False
+        return True
+
     async def download_file(self, url: str, temp_dir: str) -> str:
         """Download file from URL if needed."""
         if url.startswith(('http://', 'https://')):
+            # The session lives only as long as this download, so it never outlives its event loop
             async with aiohttp.ClientSession() as session:
                 async with session.get(url) as response:
+                    response.raise_for_status()
                     filename = os.path.basename(url.split('?')[0]) or 'document'
                     filepath = os.path.join(temp_dir, filename)
                     async with aiofiles.open(filepath, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
+                        # Write whatever the socket delivered instead of re-chunking it
+                        async for chunk in response.content.iter_any():
                             await f.write(chunk)
                     return filepath
         return url
 
-    async def pdf_to_images(self, pdf_path: str, temp_dir: str, dpi: int = 200) -> List[str]:
+    def get_page_sides(self, pdf_path: str, page_count: int) -> Dict[int, float]:
+        """Get the longest side, in points, of each page of a PDF, keyed by page number."""
+        # Given a page range, pdfinfo lists every page's size, e.g. "Page    1 size: 612 x 792 pts (letter)"
+        info = pdfinfo_from_path(pdf_path, first_page=1, last_page=page_count)
+        page_sides = {}
+        for key, value in info.items():
+            key_match = re.fullmatch(r"Page\s+(\d+)\s+size", key.strip())
+            size_match = re.match(r"([\d.]+) x ([\d.]+) pts", str(value))
+            if key_match and size_match:
+                page_sides[int(key_match.group(1))] = max(float(size_match.group(1)), float(size_match.group(2)))
+        return page_sides
+
+    def get_render_dpi(self, page_sides: List[float], dpi: int) -> int:
+        """
+        Lower dpi just enough that the smallest of these pages fits MAX_IMAGE_DIMENSION.
+        
+        Larger pages rendered at the same dpi come out oversized and are downscaled by
+        prepare_image, so no page is rendered blurry and small pages are never upscaled.
+        """
+        page_sides = [side for side in page_sides if side > 0]
+        if not page_sides:
+            return dpi
+        return max(1, min(dpi, int(MAX_IMAGE_DIMENSION * 72 / min(page_sides))))
+
+    def rasterize_pdf(
+        self,
+        pdf_path: str,
+        temp_dir: str,
+        dpi: int = 200,
+        image_format: str = "JPEG",
+        first_page: Optional[int] = None,
+        last_page: Optional[int] = None,
+        page_sides: Optional[Dict[int, float]] = None
+    ) -> List[str]:
+        """
+        Render PDF pages straight to image files with pdftocairo, returning their paths.
+        
+        dpi is lowered when the rendered pages are all larger than MAX_IMAGE_DIMENSION,
+        but never raised. page_sides is the get_page_sides result, looked up when not given.
+        """
+        if page_sides is None:
+            page_sides = self.get_page_sides(pdf_path, pdfinfo_from_path(pdf_path)["Pages"])
+        rendered_sides = [
+            side for number, side in page_sides.items()
+            if (first_page or 1) <= number <= (last_page or number)
+        ]
+        return convert_from_path(
+            pdf_path,
+            dpi=self.get_render_dpi(rendered_sides, dpi),
+            first_page=first_page,
+            last_page=last_page,
+            output_folder=temp_dir,
+            paths_only=True,
+            fmt="jpeg" if image_format.upper() == "JPEG" else "png",
+            jpegopt={"quality": 85},
+            thread_count=RENDER_THREAD_COUNT,
+            use_pdftocairo=True
+        )
+
+    async def pdf_to_images(
+        self,
+        pdf_path: str,
+        temp_dir: str,
+        dpi: int = 200,
+        image_format: str = "JPEG"
+    ) -> List[str]:
         """Convert PDF to images."""
-        images = convert_from_path(pdf_path, dpi=dpi)
-        image_paths = []
+        # pdfinfo and pdftocairo block until the whole document is rendered
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            self.rasterize_pdf,
+            pdf_path,
+            temp_dir,
+            dpi,
+            image_format
+        )
+
+    async def render_pdf_pages(
+        self,
+        pdf_path: str,
+        temp_dir: str,
+        queue: asyncio.Queue,
+        dpi: int = 200,
+        image_format: str = "JPEG",
+        chunk_size: int = RENDER_CHUNK_SIZE,
+        batch_size: int = 1
+    ) -> int:
+        """
+        Render PDF pages in chunks, putting (index, image_paths) batches on the queue as they are ready.
         
-        for i, image in enumerate(images):
-            image_path = os.path.join(temp_dir, f"page_{i+1}.png")
-            image.save(image_path, 'PNG')
-            image_paths.append(image_path)
+        Each queue item holds the zero-based index of its first page and up to
+        batch_size consecutive page image paths.
+        """
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(None, pdfinfo_from_path, pdf_path)
+        page_count = info["Pages"]
+        page_sides = await loop.run_in_executor(None, self.get_page_sides, pdf_path, page_count)
+        # Round chunks up to a whole number of batches so batches never straddle chunks
+        chunk_size = -(-chunk_size // batch_size) * batch_size
         
-        return image_paths
+        for first_page in range(1, page_count + 1, chunk_size):
+            last_page = min(first_page + chunk_size - 1, page_count)
+            image_paths = await loop.run_in_executor(None, functools.partial(
+                self.rasterize_pdf,
+                pdf_path,
+                temp_dir,
+                dpi,
+                image_format,
+                first_page=first_page,
+                last_page=last_page,
+                page_sides=page_sides
+            ))
+            await self.queue_image_batches(queue, image_paths, batch_size, first_page - 1)
+        
+        return page_count
+
+    async def queue_image_batches(
+        self,
+        queue: asyncio.Queue,
+        image_paths: List[str],
+        batch_size: int = 1,
+        first_index: int = 0
+    ) -> None:
+        """Put consecutive image paths on the queue as (index, image_paths) batches."""
+        for offset in range(0, len(image_paths), batch_size):
+            await queue.put((first_index + offset, image_paths[offset:offset + batch_size]))
 
-    async def pptx_to_images(self, pptx_path: str, temp_dir: str, dpi: int = 200) -> List[str]:
-        """Convert PowerPoint presentation to images via PDF conversion."""
+    async def pptx_to_images(
+        self,
+        pptx_path: str,
+        temp_dir: str,
+        dpi: int = 200,
+        image_format: str = "JPEG"
+    ) -> List[str]:
+        """
+        Convert PowerPoint presentation to images via PDF conversion.
+        
+        Raises PptxFallback when the presentation cannot be rendered, in which case
+        callers should use the slide text instead.
+        """
         try:
             # Get the base filename without extension
             filename_base = os.path.basename(pptx_path)
@@ -127,11 +523,14 @@ RULES:
             # Convert PPTX to PDF using LibreOffice
             pdf_path = os.path.join(temp_dir, f"{filename_bare}.pdf")
             
+            # Prefer an already running LibreOffice server when unoserver is installed
+            if await self.convert_with_unoserver(pptx_path, pdf_path):
+                return await self.pdf_to_images(pdf_path, temp_dir, dpi, image_format)
+            
             # Find LibreOffice executable
             soffice_executable = self.find_libreoffice_executable()
             if not soffice_executable:
-                print("Warning: LibreOffice executable not found, falling back to text extraction")
-                return await self.pptx_to_images_fallback(pptx_path, temp_dir)
+                raise PptxFallback("LibreOffice executable not found")
             
             # Use soffice to convert PPTX to PDF
             command_list = [
@@ -146,63 +545,48 @@ RULES:
             try:
                 result = subprocess.run(command_list, capture_output=True, text=True, timeout=60)
             except subprocess.TimeoutExpired:
-                print("Warning: LibreOffice conversion timed out, falling back to text extraction")
-                return await self.pptx_to_images_fallback(pptx_path, temp_dir)
+                raise PptxFallback("LibreOffice conversion timed out")
             
             if result.returncode != 0:
-                # Fallback to text extraction if soffice fails
-                print(f"Warning: LibreOffice conversion failed (exit code {result.returncode}): {result.stderr}")
-                return await self.pptx_to_images_fallback(pptx_path, temp_dir)
+                raise PptxFallback(f"LibreOffice conversion failed (exit code {result.returncode}): {result.stderr}")
             
             # Check if PDF was created
             if not os.path.exists(pdf_path):
-                print("Warning: PDF file was not created, falling back to text extraction")
-                return await self.pptx_to_images_fallback(pptx_path, temp_dir)
+                raise PptxFallback("PDF file was not created")
             
-            # Convert PDF to images
-            with open(pdf_path, "rb") as f:
-                pdf_bytes = f.read()
-            
-            images = convert_from_bytes(pdf_bytes, dpi=dpi)
-            image_paths = []
-            
-            for i, img in enumerate(images):
-                image_path = os.path.join(temp_dir, f"slide_{i+1}.png")
-                img.save(image_path, 'PNG')
-                image_paths.append(image_path)
-            
-            return image_paths
+            # Convert PDF to images, letting poppler read the file directly
+            return await self.pdf_to_images(pdf_path, temp_dir, dpi, image_format)
             
+        except PptxFallback:
+            raise
         except Exception as e:
-            print(f"Error in PPTX to images conversion: {e}")
-            # Fallback to text extraction
-            return await self.pptx_to_images_fallback(pptx_path, temp_dir)
+            raise PptxFallback(f"Error in PPTX to images conversion: {e}") from e
     
-    async def pptx_to_images_fallback(self, pptx_path: str, temp_dir: str) -> List[str]:
-        """Fallback method: Extract text and create simple images."""
-        presentation = Presentation(pptx_path)
-        image_paths = []
-        
-        for i, slide in enumerate(presentation.slides):
-            slide_text = []
-            
-            # Extract text from slide
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text.strip():
-                    slide_text.append(shape.text)
-            
-            if slide_text:
-                # Create a simple white image with text content
-                img = Image.new('RGB', (800, 600), color='white')
-                image_path = os.path.join(temp_dir, f"slide_{i+1}.png")
-                img.save(image_path, 'PNG')
-                image_paths.append(image_path)
-        
-        return image_paths
+    def get_slide_texts(self, slide) -> List[str]:
+        """Extract non-empty text from a slide's shapes."""
+        # getattr reads each shape's text once, where hasattr + .text would read it twice
+        return [text for shape in slide.shapes if (text := getattr(shape, "text", "")).strip()]
 
-    async def process_image(self, image_path: str, model: str = "gpt-4o-mini") -> str:
+    async def process_image(
+        self,
+        image_path: str,
+        model: str = "gpt-4o-mini",
+        rate_limiter: Optional[RateLimiter] = None
+    ) -> str:
         """Process a single image with OpenAI Vision API."""
-        base64_image = await self.encode_image_to_base64(image_path)
+        base64_image, mime_type = await self.prepare_image(image_path)
+        return await self.process_base64_image(base64_image, model, mime_type, rate_limiter)
+
+    async def process_base64_image(
+        self,
+        base64_image: str,
+        model: str = "gpt-4o-mini",
+        mime_type: str = "image/png",
+        rate_limiter: Optional[RateLimiter] = None
+    ) -> str:
+        """Send a base64-encoded image to OpenAI Vision API."""
+        if rate_limiter is not None:
+            await rate_limiter.acquire(IMAGE_TOKEN_ESTIMATE + MAX_TOKENS_PER_PAGE)
         
         response = await self.client.chat.completions.create(
             model=model,
@@ -217,35 +601,186 @@ RULES:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
+                                "url": f"data:{mime_type};base64,{base64_image}"
                             }
                         }
                     ]
                 }
             ],
-            max_tokens=4000
+            max_tokens=MAX_TOKENS_PER_PAGE
         )
         
         return response.choices[0].message.content
 
-    async def process_pptx_text(self, pptx_path: str) -> str:
-        """Process PowerPoint text directly without image conversion."""
+    async def process_encoded_batch(
+        self,
+        images: List[Tuple[str, str]],
+        model: str = "gpt-4o-mini",
+        rate_limiter: Optional[RateLimiter] = None
+    ) -> List[str]:
+        """
+        Process several (base64 data, MIME type) images with a single OpenAI Vision API request.
+        
+        The system prompt is sent once for the whole batch. If the response cannot be
+        split back into one markdown document per page, or the model rejects the batch's
+        max_tokens, each page is sent on its own instead.
+        """
+        if len(images) == 1 or model in self._unbatched_models:
+            return await self.process_encoded_pages(images, model, rate_limiter)
+        
+        instructions = (
+            f"The following {len(images)} images are consecutive pages. Convert each page separately. "
+            f"Start each page's markdown with a line containing only ---PAGE N---, "
+            f"where N is the page's position in this request (1 to {len(images)})."
+        )
+        content = [{"type": "text", "text": instructions}]
+        for base64_image, mime_type in images:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{mime_type};base64,{base64_image}"
+                }
+            })
+        
+        max_tokens = min(MAX_TOKENS_PER_PAGE * len(images), MAX_COMPLETION_TOKENS)
+        if rate_limiter is not None:
+            await rate_limiter.acquire(IMAGE_TOKEN_ESTIMATE * len(images) + max_tokens)
+        
+        try:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": self.system_prompt
+                    },
+                    {
+                        "role": "user",
+                        "content": content
+                    }
+                ],
+                max_tokens=max_tokens
+            )
+        except BadRequestError as e:
+            if "max_tokens" not in str(e):
+                raise
+            # The model's completion limit is below what the batch needs; stop batching for it
+            self._unbatched_models.add(model)
+            return await self.process_encoded_pages(images, model, rate_limiter)
+        
+        choice = response.choices[0]
+        pages = self.split_batch_response(choice.message.content, len(images))
+        if pages is None or choice.finish_reason == "length":
+            # Fall back to one request per page rather than returning misaligned pages
+            return await self.process_encoded_pages(images, model, rate_limiter)
+        
+        return pages
+
+    async def process_encoded_pages(
+        self,
+        images: List[Tuple[str, str]],
+        model: str = "gpt-4o-mini",
+        rate_limiter: Optional[RateLimiter] = None
+    ) -> List[str]:
+        """Send each (base64 data, MIME type) image in its own request, one after another."""
+        # Sequential so the requests stay within the calling API worker's concurrency slot
+        return [
+            await self.process_base64_image(base64_image, model, mime_type, rate_limiter)
+            for base64_image, mime_type in images
+        ]
+
+    def split_batch_response(self, content: Optional[str], page_count: int) -> Optional[List[str]]:
+        """Split a batched response on its page delimiters, or return None if pages are missing."""
+        parts = PAGE_DELIMITER_PATTERN.split(content or "")
+        # Every page must appear exactly once and in order; a repeated delimiter would drop text
+        if [int(number) for number in parts[1::2]] != list(range(1, page_count + 1)):
+            return None
+        return [text.strip() for text in parts[2::2]]
+
+    async def _process_images(
+        self,
+        produce: Callable[[asyncio.Queue], Awaitable[object]],
+        model: str,
+        concurrency: int,
+        rate_limiter: Optional[RateLimiter] = None,
+        image_format: str = "JPEG"
+    ) -> List[str]:
+        """
+        Run concurrent Vision API workers over the image batches that produce() queues.
+        
+        produce() is called with an asyncio.Queue and puts (index, image_paths) items on
+        it, where index is the zero-based page number of the batch's first image. Batches
+        flow through two stages: ENCODE_WORKER_COUNT workers read and base64-encode images
+        in threads, and `concurrency` workers send the encoded batches to the API, so
+        encoding later pages overlaps with requests for earlier ones. Oversized images
+        are re-encoded as image_format. Returns page markdown in page order.
+        """
+        queue = asyncio.Queue()
+        # Bounded so encoding runs only a little ahead of the API workers
+        encoded_queue = asyncio.Queue(maxsize=concurrency)
+        page_results = {}
+        
+        async def run_producer():
+            await produce(queue)
+            # One sentinel per encoder so every encoder exits once the queue drains
+            for _ in range(ENCODE_WORKER_COUNT):
+                await queue.put(None)
+        
+        async def encode():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                index, batch = item
+                prepared = await asyncio.gather(*(self.prepare_image(path, image_format) for path in batch))
+                await encoded_queue.put((index, list(prepared)))
+        
+        encoders = [asyncio.ensure_future(encode()) for _ in range(ENCODE_WORKER_COUNT)]
+        
+        async def finish_encoding():
+            await asyncio.gather(*encoders)
+            for _ in range(concurrency):
+                await encoded_queue.put(None)
+        
+        async def consume():
+            while True:
+                item = await encoded_queue.get()
+                if item is None:
+                    return
+                index, images = item
+                pages = await self.process_encoded_batch(images, model, rate_limiter)
+                for offset, page in enumerate(pages):
+                    page_results[index + offset] = page
+        
+        # Any failure propagates out of gather at once; the finally block then stops every stage
+        tasks = [asyncio.ensure_future(run_producer()), asyncio.ensure_future(finish_encoding())]
+        tasks += encoders
+        tasks += [asyncio.ensure_future(consume()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        return [page_results[index] for index in sorted(page_results)]
+
+    def get_slide_markdown(self, pptx_path: str) -> List[str]:
+        """Build a markdown section from the text of each slide that has any."""
         presentation = Presentation(pptx_path)
         slide_contents = []
         
         for i, slide in enumerate(presentation.slides):
-            slide_text = []
-            
-            # Extract text from slide
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text.strip():
-                    slide_text.append(shape.text)
+            slide_text = self.get_slide_texts(slide)
             
             if slide_text:
                 slide_content = f"## Slide {i+1}\n\n" + "\n\n".join(slide_text)
                 slide_contents.append(slide_content)
         
-        return "\n\n".join(slide_contents)
+        return slide_contents
+
+    async def process_pptx_text(self, pptx_path: str) -> str:
+        """Process PowerPoint text directly without image conversion."""
+        return "\n\n".join(self.get_slide_markdown(pptx_path))
 
     async def ocr(
         self,
@@ -253,7 +788,11 @@ RULES:
         model: str = "gpt-4o-mini",
         concurrency: int = 5,
         output_dir: Optional[str] = None,
-        cleanup: bool = True
+        cleanup: bool = True,
+        image_format: str = "JPEG",
+        batch_size: int = 4,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None
     ) -> dict:
         """
         Main function to convert PDF/image/PPTX to markdown using OpenAI Vision API.
@@ -264,68 +803,67 @@ RULES:
             concurrency: Number of concurrent requests
             output_dir: Directory to save markdown output
             cleanup: Whether to cleanup temporary files
+            image_format: Format used to encode rendered PDF/PPTX pages and downscaled images ("JPEG" or "PNG")
+            batch_size: Number of PDF/PPTX pages sent per Vision API request
+            rpm: Maximum OpenAI requests per minute, shared by all calls on this instance (unlimited if None)
+            tpm: Maximum estimated OpenAI tokens per minute, shared by all calls on this instance (unlimited if None)
             
         Returns:
             Dictionary with markdown content and metadata
         """
+        rate_limiter = self.get_rate_limiter(rpm, tpm)
+        
         with tempfile.TemporaryDirectory() as temp_dir:
             # Download file if URL
             local_path = await self.download_file(file_path, temp_dir)
             
-            # Determine file type and process accordingly
-            if self.is_pptx_file(local_path):
+            # Determine file type and pick the producer that queues its page images
+            kind = self.get_file_kind(local_path)
+            results = None
+            if kind == 'pptx':
                 # Convert PPTX to images and process with Vision API
-                image_paths = await self.pptx_to_images(local_path, temp_dir)
-                # Process images concurrently
-                semaphore = asyncio.Semaphore(concurrency)
-                
-                async def process_with_semaphore(image_path):
-                    async with semaphore:
-                        return await self.process_image(image_path, model)
-                
-                tasks = [process_with_semaphore(img_path) for img_path in image_paths]
-                results = await asyncio.gather(*tasks)
-                
-                markdown_content = "\n\n".join(results) if len(results) > 1 else results[0]
-                pages_count = len(results)
-            elif self.is_image_file(local_path):
-                image_paths = [local_path]
-                # Process images concurrently
-                semaphore = asyncio.Semaphore(concurrency)
-                
-                async def process_with_semaphore(image_path):
-                    async with semaphore:
-                        return await self.process_image(image_path, model)
-                
-                tasks = [process_with_semaphore(img_path) for img_path in image_paths]
-                results = await asyncio.gather(*tasks)
-                
-                markdown_content = "\n\n".join(results) if len(results) > 1 else results[0]
-                pages_count = len(results)
-            elif self.is_pdf_file(local_path):
-                image_paths = await self.pdf_to_images(local_path, temp_dir)
-                # Process images concurrently
-                semaphore = asyncio.Semaphore(concurrency)
-                
-                async def process_with_semaphore(image_path):
-                    async with semaphore:
-                        return await self.process_image(image_path, model)
-                
-                tasks = [process_with_semaphore(img_path) for img_path in image_paths]
-                results = await asyncio.gather(*tasks)
-                
-                markdown_content = "\n\n".join(results) if len(results) > 1 else results[0]
-                pages_count = len(results)
+                try:
+                    image_paths = await self.pptx_to_images(local_path, temp_dir, image_format=image_format)
+                except PptxFallback as e:
+                    print(f"Warning: {e}, falling back to text extraction")
+                    # Slide text is already markdown, so no Vision API request is needed
+                    results = self.get_slide_markdown(local_path)
+                else:
+                    produce = functools.partial(
+                        self.queue_image_batches,
+                        image_paths=image_paths,
+                        batch_size=batch_size
+                    )
+            elif kind == 'image':
+                produce = functools.partial(self.queue_image_batches, image_paths=[local_path])
+            elif kind == 'pdf':
+                # Stream rendered pages to the Vision API while later pages are still rendering
+                produce = functools.partial(
+                    self.render_pdf_pages,
+                    local_path,
+                    temp_dir,
+                    image_format=image_format,
+                    batch_size=batch_size
+                )
             else:
                 raise ValueError(f"Unsupported file type: {local_path}")
             
+            if results is None:
+                results = await self._process_images(produce, model, concurrency, rate_limiter, image_format)
+            markdown_content = "\n\n".join(results)
+            pages_count = len(results)
+            
             # Save to file if output_dir specified
             if output_dir:
                 os.makedirs(output_dir, exist_ok=True)
                 filename = os.path.splitext(os.path.basename(local_path))[0]
                 output_path = os.path.join(output_dir, f"{filename}.md")
-                async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-                    await f.write(markdown_content)
+                # Encode and write in one worker thread instead of streaming through aiofiles
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    None,
+                    lambda: Path(output_path).write_bytes(markdown_content.encode("utf-8"))
+                )
             
             return {
                 "content": markdown_content,
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Token bucket that refills at max_rate units per time_period seconds."""
+
+    def __init__(self, max_rate: float, time_period: float = 60):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = float(max_rate)
+        self._last_refill = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.max_rate, self._tokens + elapsed * self.max_rate / self.time_period)
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Wait until amount units are available, then consume them."""
+        # Requests larger than the whole bucket would never fit; let them drain it instead
+        amount = min(amount, self.max_rate)
+        # The bucket may outlive an event loop (e.g. several asyncio.run calls); its lock cannot
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+
+        # Waiters queue on the lock so capacity is handed out in arrival order
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) * self.time_period / self.max_rate)
+                self._refill()
+            self._tokens -= amount
+
+
+class RateLimiter:
+    """Limits OpenAI requests to a requests-per-minute and tokens-per-minute budget."""
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait until one request using an estimated number of tokens fits both budgets."""
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(tokens)